@@ -1,18 +1,31 @@
 # ========================
 # STANDARD LIBRARY IMPORTS
 # ========================
+import asyncio
+import base64
+import hashlib
+import hmac
+import secrets
 import sqlite3
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Annotated
 
 # ========================
 # THIRD-PARTY IMPORTS
 # ========================
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import bcrypt  # For password hashing
-from jose import jwt  # For JWT token generation
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, StringConstraints
+import aiosqlite  # Async SQLite driver, keeps DB waits off the event loop
+from argon2 import PasswordHasher  # Argon2id password hashing
+from argon2.exceptions import VerifyMismatchError
+import bcrypt  # Verifies legacy bcrypt password hashes
+from cachetools import TTLCache
+import orjson  # Fast JSON encoding for JWT payloads
 
 # ========================
 # CONFIGURATION
@@ -20,30 +33,104 @@ from jose import jwt  # For JWT token generation
 # Database setup
 DB_PATH = Path(__file__).parent / "users.db"
 
+# Login lookup. Kept as one constant string so sqlite3's statement cache
+# reuses the compiled plan; UNIQUE(username) gives it an index to probe.
+LOGIN_SQL = "SELECT password_hash, role, scheme FROM users WHERE username = ? LIMIT 1"
+
 # JWT Configuration
 JWT_SECRET = os.getenv("JWT_SECRET", "super-secret-key")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_SECONDS = 3600  # 1 hour
 
+# The JWT header never changes, so encode it once. HMAC key setup is done
+# once too; each token copies the keyed template instead of re-deriving it.
+_JWT_HEADER_B64 = base64.urlsafe_b64encode(
+    orjson.dumps({"alg": JWT_ALGORITHM, "typ": "JWT"})
+).rstrip(b"=")
+_JWT_HMAC = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
+
+# Argon2id parameters for new password hashes. Defaults are the OWASP
+# baseline (19 MiB, 2 passes, 1 lane); raising either slows every register/login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))  # KiB
+_PASSWORD_HASHER = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=1,
+)
+# Older accounts carry bcrypt hashes (users.scheme = 'bcrypt'); bcrypt only
+# uses the first 72 bytes of a password
+BCRYPT_MAX_PASSWORD_BYTES = 72
+# Stand-in (password_hash, role, scheme) row for unknown usernames, so they
+# cost one hash verify like a real account. Switched to a bcrypt hash at the
+# legacy accounts' cost in lifespan while any bcrypt rows remain.
+_DUMMY_USER = (_PASSWORD_HASHER.hash("x"), None, "argon2")
+# Highest bcrypt cost among legacy rows ("$2b$12$..." -> 12), NULL if none
+LEGACY_BCRYPT_COST_SQL = (
+    "SELECT MAX(CAST(substr(CAST(password_hash AS TEXT), 5, 2) AS INTEGER)) "
+    "FROM users WHERE scheme = 'bcrypt'"
+)
+
+# Recently verified logins: username -> (keyed password digest, role).
+# Lets retried or double-submitted logins skip the slow hash verify. The
+# digest key is random per process and entries expire after 30s.
+_LOGIN_CACHE = TTLCache(maxsize=2000, ttl=30)
+_LOGIN_CACHE_KEY = secrets.token_bytes(32)
+
 # Available user roles
 VALID_ROLES = ["user", "admin", "super_admin"]
 
+# Shared async DB connection, opened once per worker at startup
+db: aiosqlite.Connection | None = None
+# Password hashing runs in worker processes so concurrent logins use every core
+_HASH_POOL: ProcessPoolExecutor | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db, _HASH_POOL, _DUMMY_USER
+    _HASH_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+    # Autocommit: every write is its own transaction, no explicit commit() round trip
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    # WAL lets /login reads proceed while /register writes
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    # Legacy bcrypt verifies are far slower than Argon2id (~300ms at cost 12
+    # vs ~30ms), so an Argon2 dummy would let login timing pick out every
+    # account not yet migrated. Make unknown usernames cost a legacy verify
+    # instead. Trade-off until migration completes: already-migrated Argon2
+    # accounts answer faster than unknown names.
+    rows = await db.execute_fetchall(LEGACY_BCRYPT_COST_SQL)
+    if rows[0][0]:
+        salt = bcrypt.gensalt(rows[0][0])
+        dummy_hash = await asyncio.get_running_loop().run_in_executor(_HASH_POOL, bcrypt.hashpw, b"x", salt)
+        _DUMMY_USER = (dummy_hash, None, "bcrypt")
+    yield
+    await db.close()
+    _HASH_POOL.shutdown()
+
 
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Database initialization
 def init_db():
     with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
                 password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'user'
+                role TEXT DEFAULT 'user',
+                scheme TEXT NOT NULL DEFAULT 'bcrypt'
             )
         ''')
+        # Password hashing scheme per row, so users can move between algorithms
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        if "scheme" not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN scheme TEXT NOT NULL DEFAULT 'bcrypt'")
         conn.commit()
 
 init_db()
@@ -51,15 +138,52 @@ init_db()
 # ========================
 # PYDANTIC MODELS
 # ========================
+# Usernames are case-insensitive: trimmed and lowercased during validation.
+# Passwords are left exactly as sent.
+Username = Annotated[str, StringConstraints(strip_whitespace=True, to_lower=True)]
+
 class UserRegister(BaseModel):
-    username: str
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    username: Username
     password: str
     role: str = "user"  # Available roles: user, admin, super_admin
 
 class UserLogin(BaseModel):
-    username: str
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    username: Username
     password: str
 
+# ========================
+# PASSWORD HELPERS
+# ========================
+# These run in _HASH_POOL worker processes, so they must stay module-level
+def hash_password(password: str) -> str:
+    """Hash a new password with Argon2id"""
+    return _PASSWORD_HASHER.hash(password)
+
+def verify_password(scheme: str, stored_hash: str | bytes, password: str) -> bool:
+    """Check password against a stored hash created with the given scheme"""
+    if scheme == "bcrypt":
+        return bcrypt.checkpw(password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES], stored_hash)
+    try:
+        return _PASSWORD_HASHER.verify(stored_hash, password)
+    except VerifyMismatchError:
+        return False
+
+# ========================
+# JWT HELPERS
+# ========================
+def encode_token(payload: dict) -> str:
+    """Sign payload as an HS256 JWT"""
+    payload_b64 = base64.urlsafe_b64encode(orjson.dumps(payload)).rstrip(b"=")
+    signing_input = _JWT_HEADER_B64 + b"." + payload_b64
+    mac = _JWT_HMAC.copy()
+    mac.update(signing_input)
+    signature_b64 = base64.urlsafe_b64encode(mac.digest()).rstrip(b"=")
+    return (signing_input + b"." + signature_b64).decode()
+
 # ========================
 # ROUTES
 # ========================
@@ -80,18 +204,16 @@ def get_available_roles():
     }
 
 @app.post("/register")
-def register_user(user_data: UserRegister):
+async def register_user(user_data: UserRegister):
     # Validate input
     if not user_data.username or not user_data.password:
         raise HTTPException(status_code=400, detail="Username and password required")
     
-    # Clean username
-    username = user_data.username.strip().lower()
+    username = user_data.username
     
-    # Hash password using bcrypt directly
-    password_bytes = user_data.password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    password_hash = bcrypt.hashpw(password_bytes, salt)
+    # Hash password with Argon2id in the process pool (CPU-bound)
+    loop = asyncio.get_running_loop()
+    password_hash = await loop.run_in_executor(_HASH_POOL, hash_password, user_data.password)
     
     # Validate role
     if user_data.role not in VALID_ROLES:
@@ -102,39 +224,56 @@ def register_user(user_data: UserRegister):
     
     # Insert user into database
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                (username, password_hash, user_data.role)
-            )
-            conn.commit()
-    except sqlite3.IntegrityError:
+        await db.execute(
+            "INSERT INTO users (username, password_hash, role, scheme) VALUES (?, ?, ?, 'argon2')",
+            (username, password_hash, user_data.role)
+        )
+    except aiosqlite.IntegrityError:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     return {"message": f"User '{username}' registered successfully"}
 
 
-@app.post("/login")
-def login(user_data: UserLogin):
-    username = user_data.username.strip().lower()
-    password = user_data.password.encode("utf-8")
-
+async def authenticate_user(username: str, password: str) -> str:
+    """Check credentials against the DB and return the user's role"""
     # Fetch user from DB
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
-        row = cur.fetchone()
-
-        if not row:
-            raise HTTPException(status_code=401, detail="Invalid username or password")
+    rows = await db.execute_fetchall(LOGIN_SQL, (username,))
+    row = rows[0] if rows else None
 
-        stored_hash, user_role = row
+    # Unknown users still pay for a verify, so timing doesn't reveal which usernames exist
+    stored_hash, user_role, scheme = row if row else _DUMMY_USER
 
-    # Check password using bcrypt
-    if not bcrypt.checkpw(password, stored_hash):
+    # Check password in the process pool (CPU-bound)
+    loop = asyncio.get_running_loop()
+    password_ok = await loop.run_in_executor(_HASH_POOL, verify_password, scheme, stored_hash, password)
+    if not row or not password_ok:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    # Move bcrypt users (or outdated Argon2 parameters) to the current hash
+    if scheme != "argon2" or _PASSWORD_HASHER.check_needs_rehash(stored_hash):
+        new_hash = await loop.run_in_executor(_HASH_POOL, hash_password, password)
+        await db.execute(
+            "UPDATE users SET password_hash = ?, scheme = 'argon2' WHERE username = ?",
+            (new_hash, username)
+        )
+
+    return user_role
+
+
+@app.post("/login")
+async def login(user_data: UserLogin):
+    username = user_data.username
+    password = user_data.password
+
+    # Repeat of a recent successful login: skip the hash verify
+    password_digest = hmac.new(_LOGIN_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+    cached = _LOGIN_CACHE.get(username)
+    if cached is not None and hmac.compare_digest(cached[0], password_digest):
+        user_role = cached[1]
+    else:
+        user_role = await authenticate_user(username, password)
+        _LOGIN_CACHE[username] = (password_digest, user_role)
+
     # Generate JWT with role
     now = int(time.time())
     payload = {
@@ -144,7 +283,7 @@ def login(user_data: UserLogin):
         "exp": now + JWT_EXPIRE_SECONDS,
         "scope": "read write"
     }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    token = encode_token(payload)
 
     return {
         "access_token": token,
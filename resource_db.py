@@ -6,23 +6,63 @@ import sqlite3
 from pathlib import Path
 
 DB_PATH = Path(__file__).parent / "data.db"
+LOCK_PATH = DB_PATH.with_suffix(".db.lock")
+
+# Numeric rank of each access level, exposed as items.access_level_int so
+# RBAC checks compare integers in SQL
+ACCESS_LEVELS = {
+    "public": 0,     # Everyone can see
+    "user": 1,       # Registered users and above
+    "admin": 2,      # Admins and above
+    "super_admin": 3 # Only super admins
+}
+
+# access_level_int is a virtual generated column: SQLite derives it from
+# access_level, so writers can't leave it out of sync. Unknown levels get
+# the highest rank, so a bad value hides the item instead of publishing it.
+ACCESS_LEVEL_INT_COLUMN = (
+    "access_level_int INTEGER GENERATED ALWAYS AS (CASE access_level "
+    + " ".join(f"WHEN '{level}' THEN {num}" for level, num in ACCESS_LEVELS.items())
+    + f" ELSE {max(ACCESS_LEVELS.values())} END) VIRTUAL"
+)
 
 def init_db():
+    """Create the items table/indexes and seed sample data on first run"""
+    # Serialize setup when several processes migrate at once. fcntl is
+    # POSIX-only, so import it here to keep the servers importable elsewhere.
+    import fcntl
+
+    with open(LOCK_PATH, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _init_db()
+
+def _init_db():
     with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('''
+        conn.execute(f'''
             CREATE TABLE IF NOT EXISTS items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 title TEXT NOT NULL,
                 description TEXT,
                 owner TEXT NOT NULL,
                 access_level TEXT NOT NULL DEFAULT 'public',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                {ACCESS_LEVEL_INT_COLUMN}
             )
         ''')
+        # Older databases have no access_level_int, or a plain column that
+        # had to be written by hand: replace it with the generated one.
+        # table_xinfo reports hidden=2 for virtual generated columns.
+        columns = {row[1]: row[6] for row in conn.execute("PRAGMA table_xinfo(items)")}
+        if columns.get("access_level_int") != 2:
+            conn.execute("DROP INDEX IF EXISTS idx_items_access_int")
+            if "access_level_int" in columns:
+                conn.execute("ALTER TABLE items DROP COLUMN access_level_int")
+            conn.execute(f"ALTER TABLE items ADD COLUMN {ACCESS_LEVEL_INT_COLUMN}")
+        # Serves the role-filtered, newest-first /items query
+        conn.execute("DROP INDEX IF EXISTS idx_items_access")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_items_access_int ON items(access_level_int, created_at DESC)")
         # Add sample data with different access levels
-        cur.execute("SELECT COUNT(*) FROM items")
-        if cur.fetchone()[0] == 0:
+        if conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0:
             sample_data = [
                 # PUBLIC LEVEL - Everyone can see (4 items)
                 ("Welcome Message", "Welcome to our platform! This is visible to everyone.", "system", "public"),
@@ -50,7 +90,11 @@ def init_db():
                 ("Financial Reports", "Sensitive financial data and reports", "system", "super_admin"),
                 ("Executive Decisions", "Board meeting minutes and strategic plans", "system", "super_admin")
             ]
-            cur.executemany("INSERT INTO items (title, description, owner, access_level) VALUES (?, ?, ?, ?)", sample_data)
+            conn.executemany(
+                "INSERT INTO items (title, description, owner, access_level) VALUES (?, ?, ?, ?)",
+                sample_data
+            )
         conn.commit()
 
-init_db()
\ No newline at end of file
+if __name__ == "__main__":
+    init_db()
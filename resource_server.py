@@ -1,71 +1,72 @@
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
-from pydantic import BaseModel
-import sqlite3
+from pydantic import BaseModel, ConfigDict
+from cachetools import TTLCache
+import orjson
+from contextlib import asynccontextmanager
+import aiosqlite
+import argparse
+import base64
+import hashlib
+import hmac
+import time
 import os
-from pathlib import Path
+
+from resource_db import ACCESS_LEVELS, DB_PATH, init_db
 
 # ========================
 # CONFIG  
 # ========================
 JWT_SECRET = os.getenv("JWT_SECRET", "super-secret-key")  # Should match auth server
-JWT_ALGORITHM = "HS256"
-DB_PATH = Path(__file__).parent / "data.db"
 
-app = FastAPI(title="Resource Server - Protected API")
-auth_scheme = HTTPBearer()
+# Keyed HMAC-SHA256 (HS256) template; each verify copies it instead of
+# redoing the key setup
+_JWT_HMAC = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
 
-# ========================
-# DATABASE SETUP
-# ========================
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                owner TEXT NOT NULL,
-                access_level TEXT NOT NULL DEFAULT 'public',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Add sample data with different access levels
-        cur.execute("SELECT COUNT(*) FROM items")
-        if cur.fetchone()[0] == 0:
-            sample_data = [
-                # PUBLIC LEVEL - Everyone can see (4 items)
-                ("Welcome Message", "Welcome to our platform! This is visible to everyone.", "system", "public"),
-                ("Company News", "Latest company updates and announcements", "system", "public"),
-                ("Public Events", "Upcoming public events and webinars", "system", "public"),
-                ("Contact Info", "Public contact information and office hours", "system", "public"),
-                
-                # USER LEVEL - Registered users and above (6 items)
-                ("Team Calendar", "Internal team calendar and schedules", "system", "user"),
-                ("Project Updates", "Current project status and milestones", "system", "user"),
-                ("Employee Resources", "HR resources and employee handbook", "system", "user"),
-                ("Internal Tools", "Links to internal development tools", "system", "user"),
-                ("Training Materials", "Employee training and onboarding docs", "system", "user"),
-                ("Team Chat Logs", "Important discussions and meeting notes", "system", "user"),
-                
-                # ADMIN LEVEL - Admins and above (5 items)
-                ("Server Configs", "Production server configuration details", "system", "admin"),
-                ("User Management", "User account management and permissions", "system", "admin"),
-                ("Database Backups", "Database backup schedules and procedures", "system", "admin"),
-                ("API Keys", "Third-party API keys and integration details", "system", "admin"),
-                ("System Monitoring", "Server monitoring and alert configurations", "system", "admin"),
-                
-                # SUPER_ADMIN LEVEL - Only super admins (3 items)
-                ("Security Audit", "Confidential security audit results", "system", "super_admin"),
-                ("Financial Reports", "Sensitive financial data and reports", "system", "super_admin"),
-                ("Executive Decisions", "Board meeting minutes and strategic plans", "system", "super_admin")
-            ]
-            cur.executemany("INSERT INTO items (title, description, owner, access_level) VALUES (?, ?, ?, ?)", sample_data)
-        conn.commit()
-
-init_db()
+# Decoded JWT payloads keyed by raw token. Clients replay the same Bearer
+# token many times, so skip re-verifying it until it expires. The TTL is
+# well below the 1h token lifetime to bound how stale an entry can get.
+_JWT_CACHE = TTLCache(maxsize=10_000, ttl=60)
+
+# Columns returned by /items, in SELECT order. Rows come back as plain
+# tuples and are zipped with these names, skipping sqlite3.Row objects.
+ITEM_COLUMNS = ("id", "title", "description", "owner", "access_level", "created_at")
+# access_level_int is generated by SQLite from access_level
+_INSERT_ITEM_SQL = "INSERT INTO items (title, description, owner, access_level) VALUES (?, ?, ?, ?)"
+
+# Shared async DB connection, opened once per worker at startup
+db: aiosqlite.Connection | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db
+    # Autocommit: every write is its own transaction, no explicit commit() round trip
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    # WAL lets /items reads proceed while new items are being written
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    # Refuse to start on a schema older than this code (hidden=2 marks the
+    # generated access_level_int column created by the migrate step)
+    columns = {row[1]: row[6] for row in await db.execute_fetchall("PRAGMA table_xinfo(items)")}
+    if columns.get("access_level_int") != 2:
+        await db.close()
+        raise RuntimeError(
+            f"{DB_PATH} has an outdated items schema; run `python -m resource_server --migrate`"
+        )
+    yield
+    await db.close()
+
+
+app = FastAPI(
+    title="Resource Server - Protected API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+auth_scheme = HTTPBearer()
 
 # ========================
 # RBAC CONFIG
@@ -77,46 +78,72 @@ ROLE_HIERARCHY = {
     "super_admin": 3
 }
 
-ACCESS_LEVELS = {
-    "public": 0,     # Everyone can see
-    "user": 1,       # Registered users and above
-    "admin": 2,      # Admins and above
-    "super_admin": 3 # Only super admins
+# ACCESS_LEVELS (access level name -> rank) lives in resource_db, since the
+# rank is also stored in the items table
+
+# One /items query per role rank with the rank written into the SQL, so each
+# is its own cached prepared statement with nothing to bind. The top rank
+# sees everything and needs no filter.
+ITEMS_SQL = {
+    level: f"SELECT {', '.join(ITEM_COLUMNS)} FROM items"
+    + (f" WHERE access_level_int <= {level}" if level < max(ACCESS_LEVELS.values()) else "")
+    + " ORDER BY created_at DESC"
+    for level in ROLE_HIERARCHY.values()
 }
 
 def get_user_role(payload: dict) -> str:
     """Extract role from JWT payload, default to 'guest'"""
     return payload.get("role", "guest")
 
-def can_access(user_role: str, required_level: str) -> bool:
-    """Check if user role can access the required level"""
-    user_level = ROLE_HIERARCHY.get(user_role, 0)
-    required_level_num = ACCESS_LEVELS.get(required_level, 0)
-    return user_level >= required_level_num
-
 # ========================
 # MODELS
 # ========================
 class CreateItem(BaseModel):
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True, extra="forbid")
+
     title: str
     description: str = ""
     access_level: str = "public"  # public, user, admin, super_admin
 
+# ========================
+# JWT HELPERS
+# ========================
+def _b64url_decode(data: str) -> bytes:
+    # validate=True rejects stray characters instead of silently dropping them
+    return base64.b64decode(data + "=" * (-len(data) % 4), altchars=b"-_", validate=True)
+
+def decode_token(token: str) -> dict:
+    """Verify an HS256 JWT from the auth server and return its payload.
+
+    Raises ValueError if the token is malformed, badly signed or expired.
+    """
+    header_b64, payload_b64, signature_b64 = token.split(".")
+    mac = _JWT_HMAC.copy()
+    mac.update(f"{header_b64}.{payload_b64}".encode("ascii"))
+    if not hmac.compare_digest(mac.digest(), _b64url_decode(signature_b64)):
+        raise ValueError("Invalid token signature")
+    payload = orjson.loads(_b64url_decode(payload_b64))
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid token payload")
+    exp = payload.get("exp")
+    if not isinstance(exp, (int, float)) or exp <= time.time():
+        raise ValueError("Token expired")
+    return payload
+
 # ========================
 # DEPENDENCY: Verify token
 # ========================
-def verify_token(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> dict:
+async def verify_token(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> dict:
     token = creds.credentials
+    cached = _JWT_CACHE.get(token)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
     try:
-        payload = jwt.decode(
-            token,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM],
-            options={"verify_aud": False}
-        )
-        return payload
-    except JWTError:
+        payload = decode_token(token)
+    except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    _JWT_CACHE[token] = payload
+    return payload
 
 # ========================
 # ROUTES
@@ -126,64 +153,84 @@ def health():
     return {"status": "ok"}
 
 @app.get("/items")
-def get_items(payload: dict = Depends(verify_token)):
+async def get_items(payload: dict = Depends(verify_token)):
     """Get items based on user's role and access level"""
     username = payload.get("sub", "anonymous")
     user_role = get_user_role(payload)
     
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM items ORDER BY created_at DESC")
-        all_items = [dict(row) for row in cur.fetchall()]
-    
-    # Filter items based on user's access level
-    accessible_items = []
-    for item in all_items:
-        if can_access(user_role, item["access_level"]):
-            accessible_items.append(item)
-    
-    return {
-        "user": username, 
-        "role": user_role,
-        "items": accessible_items,
-        "total_accessible": len(accessible_items),
-        "total_items": len(all_items)
-    }
+    # Only fetch the access levels this role can see
+    sql = ITEMS_SQL[ROLE_HIERARCHY.get(user_role, 0)]
+
+    rows = await db.execute_fetchall("SELECT COUNT(*) FROM items")
+    total_items = rows[0][0]
+
+    # Run the query and read the first batch before any bytes go out, so a
+    # DB error still becomes a normal 500 rather than a truncated 200
+    cur = await db.execute(sql)
+    try:
+        rows = await cur.fetchmany(100)
+    except Exception:
+        await cur.close()
+        raise
+
+    async def stream_items(rows):
+        # Rows are encoded batch by batch as they come off the cursor, so the
+        # full item list is never held in memory. total_accessible is only
+        # known at the end, hence it follows the items array.
+        try:
+            yield orjson.dumps({"user": username, "role": user_role})[:-1] + b',"items":['
+            total_accessible = 0
+            while rows:
+                if total_accessible:
+                    yield b","
+                yield b",".join(orjson.dumps(dict(zip(ITEM_COLUMNS, row))) for row in rows)
+                total_accessible += len(rows)
+                rows = await cur.fetchmany(100)
+            yield b'],"total_accessible":%d,"total_items":%d}' % (total_accessible, total_items)
+        finally:
+            await cur.close()
+
+    return StreamingResponse(stream_items(rows), media_type="application/json")
 
 @app.post("/items")
-def create_item(item: CreateItem, payload: dict = Depends(verify_token)):
+async def create_item(item: CreateItem, payload: dict = Depends(verify_token)):
     """Create a new item with access level"""
     username = payload.get("sub", "anonymous")
     user_role = get_user_role(payload)
     
-    # Validate access level
-    if item.access_level not in ACCESS_LEVELS:
+    # Validate access level and check the user's rank covers it
+    required_level = ACCESS_LEVELS.get(item.access_level)
+    if required_level is None:
         raise HTTPException(status_code=400, detail="Invalid access level")
-    
-    # Check if user can create items with this access level
-    if not can_access(user_role, item.access_level):
+    if required_level > ROLE_HIERARCHY.get(user_role, 0):
         raise HTTPException(
             status_code=403, 
             detail=f"Insufficient permissions to create {item.access_level} items"
         )
     
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO items (title, description, owner, access_level) VALUES (?, ?, ?, ?)",
-            (item.title, item.description, username, item.access_level)
-        )
-        item_id = cur.lastrowid
-        conn.commit()
+    cur = await db.execute(
+        _INSERT_ITEM_SQL,
+        (item.title, item.description, username, item.access_level)
+    )
     
-    return {
+    # Return the response directly, skipping FastAPI's jsonable_encoder pass
+    return ORJSONResponse({
         "message": "Item created", 
-        "id": item_id, 
+        "id": cur.lastrowid, 
         "owner": username,
         "access_level": item.access_level
-    }
+    })
 
 @app.get("/profile")
 def get_profile(payload: dict = Depends(verify_token)):
     return {"username": payload.get("sub"), "message": "This is your profile"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resource server maintenance")
+    parser.add_argument("--migrate", action="store_true", help="create tables and seed sample items")
+    args = parser.parse_args()
+    if args.migrate:
+        init_db()
+    else:
+        parser.print_help()